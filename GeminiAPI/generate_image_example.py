@@ -1,13 +1,18 @@
-import base64
 import os
+import mimetypes
 from google import genai
 from google.genai import types
 
 
 def save_binary_file(file_name, data):
-    f = open(file_name, "wb")
-    f.write(data)
-    f.close()
+    """Write data to a new file at file_name straight through a raw file descriptor"""
+    fd = os.open(file_name, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, "O_BINARY", 0), 0o644)
+    try:
+        view = memoryview(data)
+        while view:
+            view = view[os.write(fd, view):]
+    finally:
+        os.close(fd)
 
 
 def generate():
@@ -66,25 +71,33 @@ def generate():
         response_mime_type="text/plain",
     )
 
+    file_name = "ENTER_FILE_NAME"
+    # Every inline_data part is a complete image, so each one gets its own file
+    image_count = 0
     for chunk in client.models.generate_content_stream(
         model=model,
         contents=contents,
         config=generate_content_config,
     ):
-        if not chunk.candidates or not chunk.candidates[0].content or not chunk.candidates[0].content.parts:
+        if not chunk.candidates:
             continue
-        if chunk.candidates[0].content.parts[0].inline_data:
-            file_name = "ENTER_FILE_NAME"
-            save_binary_file(
-                file_name, chunk.candidates[0].content.parts[0].inline_data.data
-            )
-            print(
-                "File of mime type"
-                f" {chunk.candidates[0].content.parts[0].inline_data.mime_type} saved"
-                f"to: {file_name}"
-            )
-        else:
-            print(chunk.text)
+        content = chunk.candidates[0].content
+        if not content or not content.parts:
+            continue
+        for part in content.parts:
+            inline_data = getattr(part, "inline_data", None)
+            if inline_data:
+                extension = mimetypes.guess_extension(inline_data.mime_type or "") or ""
+                image_name = f"{file_name}_{image_count}{extension}"
+                image_count += 1
+                save_binary_file(image_name, inline_data.data)
+                print(
+                    "File of mime type"
+                    f" {inline_data.mime_type} saved"
+                    f" to: {image_name}"
+                )
+            elif part.text:
+                print(part.text)
 
 if __name__ == "__main__":
     generate()
@@ -1,71 +1,49 @@
 import os
 import sys
-import base64
+import time
 import asyncio
-import subprocess
-from datetime import datetime
-from io import BytesIO
-from PIL import Image
+import contextlib
+import webbrowser
+from pathlib import Path
+from collections import OrderedDict
 from google import genai
 from google.genai import types
 
+# Optional: in-process ICMP pings without spawning a ping process per host
+try:
+    from icmplib import async_ping
+except ImportError:
+    async_ping = None
+
+# Images are written straight to a raw file descriptor, skipping Python's buffered file layer
+_IMAGE_OPEN_FLAGS = os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, "O_BINARY", 0)
+
+def _write_all(fd, data):
+    """Write every byte of data to a raw file descriptor"""
+    view = memoryview(data)
+    while view:
+        view = view[os.write(fd, view):]
+
+def _write_file(path, data):
+    """Write data to a new file at path, which only appears once it is complete"""
+    tmp_path = f"{path}.part"
+    fd = os.open(tmp_path, _IMAGE_OPEN_FLAGS, 0o644)
+    try:
+        _write_all(fd, data)
+    except BaseException:
+        os.close(fd)
+        os.unlink(tmp_path)
+        raise
+    os.close(fd)
+    os.replace(tmp_path, path)
+
 class GeminiNetworkInterface:
     """
     A system that uses Gemini to become both the interface and backend controller
     for managing networked computers directly.
     """
-    def __init__(self, api_key=None):
-        # Initialize the Gemini client
-        self.client = genai.Client(api_key=api_key or os.environ.get("GEMINI_API_KEY"))
-        self.model = "gemini-2.0-flash-exp"  # Model with image generation capabilities
-        self.machines = {}
-        self.img_count = 0
-        self.current_prompt_state = {}
-        
-        # Initialize with our known machines
-        self.machines["headless-server"] = {"ip": "192.168.1.53", "status": "unknown"}
-        self.machines["laptop"] = {"ip": "192.168.1.227", "status": "unknown"}
-
-    def save_image(self, image_data, prefix="network_interface"):
-        """Save the generated image to a file"""
-        img_path = f"{prefix}_{self.img_count}.png"
-        with open(img_path, "wb") as f:
-            f.write(image_data)
-        self.img_count += 1
-        return img_path
-
-    def ping_machine(self, ip_address):
-        """Check if a machine is reachable via ping"""
-        try:
-            # Different ping command parameters based on OS
-            param = '-n' if sys.platform.lower() == 'windows' else '-c'
-            command = ['ping', param, '1', ip_address]
-            
-            # Execute the ping command
-            result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=2)
-            
-            # Return True if ping was successful (return code 0)
-            return result.returncode == 0
-        except subprocess.TimeoutExpired:
-            return False
-        except Exception as e:
-            print(f"Error pinging {ip_address}: {str(e)}")
-            return False
-
-    def check_all_machines(self):
-        """Check the status of all machines in inventory"""
-        for name, data in self.machines.items():
-            reachable = self.ping_machine(data["ip"])
-            self.machines[name]["status"] = "online" if reachable else "offline"
-            self.machines[name]["last_checked"] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-
-    async def generate_network_interface(self, user_query=None):
-        """Generate a visual interface using Gemini based on network status and user query"""
-        # First, check the status of our machines
-        self.check_all_machines()
-        
-        # Prepare the system instruction with details about our approach
-        system_instruction = """
+    # Instructions describing our approach; these never change between calls
+    _SYSTEM_INSTRUCTION = """
         You are an AI system that GENERATES IMAGES of network management interfaces. 
         You are the interface itself - not a tool that controls existing UIs.
         
@@ -83,31 +61,13 @@ class GeminiNetworkInterface:
         and manage these machines.
         """
 
-        # Format current machine status
-        machine_status = ""
-        for name, data in self.machines.items():
-            status_color = "green" if data["status"] == "online" else "red"
-            machine_status += f"Machine: {name}\n"
-            machine_status += f"IP: {data['ip']}\n"
-            machine_status += f"Status: {data['status']} (colored {status_color})\n"
-            if "last_checked" in data:
-                machine_status += f"Last Checked: {data['last_checked']}\n"
-            machine_status += "\n"
-        
-        # Create the full prompt for image generation
-        action_prompt = user_query if user_query else "Show me the status of machines on my network"
-        
-        complete_prompt = f"""
-        {action_prompt}
-        
-        Current Time: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
-        
-        Network Machines Status:
-        {machine_status}
-        
+    # Prompt skeletons, formatted with only the values that change per call. The fixed wording
+    # comes first and the per-call values last, so consecutive requests share a long prefix
+    _STATUS_ROW = "Machine: {name}\nIP: {ip}\nStatus: {status} (colored {color})\nLast Checked: {last_checked}\n".format
+    _PROMPT_TEMPLATE = """
         IMPORTANT: This is not about creating an interface mock-up or design. You ARE the interface.
         The image you generate IS the actual interface that users will interact with.
-        Create a dashboard visualization showing this network information.
+        Create a dashboard visualization showing the network information below.
         
         Include in your visualization:
         1. Status indicators for each machine
@@ -115,64 +75,265 @@ class GeminiNetworkInterface:
         3. All relevant network information with clean typography
         4. A way to see what operations are available (like "Ping", "Connect", "Get Info")
         5. Make it look like a real application, not a sketch or wireframe
-        """
+        
+        Request: {action}
+        
+        Network Machines Status:
+        {machine_status}
+        
+        Current Time: {time}
+        """.format
 
-        # Configure the image generation
-        generate_content_config = types.GenerateContentConfig(
+    def __init__(self, api_key=None, client=None, status_ttl=30, image_cache_size=16):
+        # Initialize the Gemini client, or share one passed in along with its open connections;
+        # with aiohttp installed, its async calls stream natively on the event loop
+        self.client = client or genai.Client(api_key=api_key or os.environ.get("GEMINI_API_KEY"))
+        self.model = "gemini-2.0-flash-exp"  # Model with image generation capabilities
+        self.machines = {}
+        self.img_count = 0
+        self.current_prompt_state = {}
+        
+        # Configure the image generation once; it is the same for every request
+        self._generate_content_config = types.GenerateContentConfig(
             temperature=0.2,
             top_p=0.95,
             top_k=40,
             response_modalities=["image"],
         )
-
-        # Structure the conversation for better image generation
-        contents = [
+        
+        # Structure the conversation for better image generation. The image model does not
+        # accept a system_instruction, so our instructions go first as a fixed user/model
+        # exchange that is built once and sent unchanged ahead of every request
+        self._conversation_prefix = (
             types.Content(
                 role="user",
-                parts=[types.Part.from_text(text=system_instruction)]
+                parts=[types.Part.from_text(text=self._SYSTEM_INSTRUCTION)]
             ),
             types.Content(
                 role="model",
                 parts=[types.Part.from_text(text="I'll generate a network management interface that directly displays the status of your machines. This will be a finished product view, not a mockup.")]
             ),
+        )
+        
+        # Formatted timestamp, cached for the second it was taken in
+        self._ts_sec = None
+        self._ts_str = None
+        
+        # Machine status is only re-checked once it is older than status_ttl seconds,
+        # and its prompt text is only rebuilt when the status actually changed
+        self.status_ttl = status_ttl
+        self._status_cache = {"sig": None, "text": None, "ts": float("-inf")}
+        
+        # Recently generated images by (user query, machine states), least recently used first
+        self.image_cache_size = image_cache_size
+        self._image_cache = OrderedDict()
+        self._pending_images = {}
+        
+        # Initialize with our known machines
+        self.machines["headless-server"] = {"ip": "192.168.1.53", "status": "unknown"}
+        self.machines["laptop"] = {"ip": "192.168.1.227", "status": "unknown"}
+
+    def _now_str(self):
+        """Current local time as a string, formatted at most once per second"""
+        now = int(time.time())
+        if now != self._ts_sec:
+            self._ts_str = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(now))
+            self._ts_sec = now
+        return self._ts_str
+
+    def next_image_path(self, prefix="network_interface"):
+        """Reserve the file name for the next generated image"""
+        img_path = f"{prefix}_{self.img_count}.png"
+        self.img_count += 1
+        return img_path
+
+    async def ping_machine(self, ip_address):
+        """Check if a machine is reachable via ping"""
+        if async_ping is not None:
+            try:
+                host = await async_ping(ip_address, count=2, interval=0.2, timeout=1, privileged=False)
+                return host.is_alive
+            except Exception:
+                # Unprivileged ICMP sockets may be disabled on this system, fall back to the ping command
+                pass
+        
+        try:
+            # Different ping command parameters based on OS
+            param = '-n' if sys.platform.lower() == 'windows' else '-c'
+            command = ['ping', param, '1', ip_address]
+            
+            # Execute the ping command without blocking the event loop
+            process = await asyncio.create_subprocess_exec(
+                *command, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+            )
+            try:
+                await asyncio.wait_for(process.communicate(), timeout=2)
+            except asyncio.TimeoutError:
+                process.kill()
+                await process.wait()
+                return False
+            
+            # Return True if ping was successful (return code 0)
+            return process.returncode == 0
+        except Exception as e:
+            print(f"Error pinging {ip_address}: {str(e)}")
+            return False
+
+    async def check_all_machines(self):
+        """Check the status of all machines in inventory"""
+        # Ping every machine concurrently so the sweep costs one timeout, not one per machine
+        names = list(self.machines)
+        results = await asyncio.gather(*(self.ping_machine(self.machines[name]["ip"]) for name in names))
+        for name, reachable in zip(names, results):
+            self.machines[name]["status"] = "online" if reachable else "offline"
+            self.machines[name]["last_checked"] = self._now_str()
+
+    def format_machine_status(self):
+        """Describe the status of every machine for the prompt, reusing the last text if nothing changed"""
+        sig = tuple((name, data["ip"], data["status"], data.get("last_checked"))
+                    for name, data in sorted(self.machines.items()))
+        if sig != self._status_cache["sig"]:
+            self._status_cache["sig"] = sig
+            self._status_cache["text"] = "\n".join(
+                self._STATUS_ROW(
+                    name=name,
+                    ip=data["ip"],
+                    status=data["status"],
+                    color="green" if data["status"] == "online" else "red",
+                    last_checked=data.get("last_checked", "n/a"),
+                )
+                for name, data in self.machines.items()
+            )
+        return self._status_cache["text"]
+
+    def status_is_stale(self):
+        """Whether the last status sweep is older than status_ttl"""
+        return time.monotonic() - self._status_cache["ts"] >= self.status_ttl
+
+    async def refresh_machine_status(self):
+        """Check the status of our machines unless we did so very recently"""
+        if self.status_is_stale():
+            await self.check_all_machines()
+            self._status_cache["ts"] = time.monotonic()
+
+    async def stream_network_interface(self, user_query=None, refresh=True):
+        """Generate a visual interface, yielding each image as it streams in from Gemini"""
+        # First, make sure the machine status we are about to show is current
+        if refresh:
+            await self.refresh_machine_status()
+        
+        # Format current machine status
+        machine_status = self.format_machine_status()
+        
+        # Create the full prompt for image generation
+        action_prompt = user_query if user_query else "Show me the status of machines on my network"
+        
+        complete_prompt = self._PROMPT_TEMPLATE(action=action_prompt, time=self._now_str(), machine_status=machine_status)
+
+        # Only the final turn changes between calls; the preamble is shared
+        contents = [
+            *self._conversation_prefix,
             types.Content(
                 role="user",
                 parts=[types.Part.from_text(text=complete_prompt)]
             )
         ]
 
-        # Generate the image
-        try:
-            response = None
-            async for chunk in self.client.aio.models.generate_content_stream(
-                model=self.model,
-                contents=contents,
-                config=generate_content_config,
-            ):
-                if (not chunk.candidates or not chunk.candidates[0].content or 
-                    not chunk.candidates[0].content.parts):
+        # Generate the image, handing each one to the caller as soon as it arrives; every
+        # inline_data part is a complete image, not a piece of one
+        # Closing the stream on the way out releases its connection, even if we stop reading early
+        async with contextlib.aclosing(await self.client.aio.models.generate_content_stream(
+            model=self.model,
+            contents=contents,
+            config=self._generate_content_config,
+        )) as stream:
+            async for chunk in stream:
+                candidates = chunk.candidates
+                if not candidates:
+                    continue
+                content = candidates[0].content
+                if not content or not content.parts:
                     continue
                 
-                part = chunk.candidates[0].content.parts[0]
-                if hasattr(part, 'inline_data') and part.inline_data:
-                    response = chunk
-                    break
+                inline_data = getattr(content.parts[0], 'inline_data', None)
+                if inline_data:
+                    yield inline_data.data
+
+    async def write_network_interface(self, img_path, user_query=None):
+        """Save the first image of the interface for the current machine status to img_path, returning its bytes or None"""
+        # If the model sends several images we keep the first and stop reading
+        async with contextlib.aclosing(self.stream_network_interface(user_query, refresh=False)) as images:
+            async for image_data in images:
+                await asyncio.to_thread(_write_file, img_path, image_data)
+                return image_data
+        return None
+
+    def status_signature(self):
+        """The machine states an interface image depends on"""
+        return tuple(sorted((name, data["status"]) for name, data in self.machines.items()))
+
+    async def generate_network_interface(self, user_query=None):
+        """Generate a visual interface using Gemini based on network status and user query"""
+        # Identical requests made while one is still running share its result
+        query = user_query or ""
+        pending = self._pending_images.get(query)
+        if pending is None:
+            pending = self._pending_images[query] = asyncio.ensure_future(self._generate_network_interface(query))
+            pending.add_done_callback(lambda _: self._pending_images.pop(query, None))
+        return await asyncio.shield(pending)
+
+    async def _generate_network_interface(self, user_query):
+        """Produce the interface image for user_query, reusing a cached one when nothing changed"""
+        img_path = None
+        generation = None
+        try:
+            # When a sweep is due and we already know every machine's status, start generating
+            # from that status while the sweep runs; only start over if a machine changed state
+            known_status = self.status_signature()
+            if (self.status_is_stale() and "unknown" not in dict(known_status).values()
+                    and (user_query, known_status) not in self._image_cache):
+                img_path = self.next_image_path()
+                generation = asyncio.create_task(self.write_network_interface(img_path, user_query))
+            
+            await self.refresh_machine_status()
             
-            if not response or not hasattr(response.candidates[0].content.parts[0], 'inline_data'):
+            status = self.status_signature()
+            if generation is not None and status != known_status:
+                generation.cancel()
+                with contextlib.suppress(asyncio.CancelledError, Exception):
+                    await generation
+                generation = None
+            
+            # The same request against the same machine states was answered recently
+            cache_key = (user_query, status)
+            cached_path = self._image_cache.get(cache_key)
+            if cached_path is not None and os.path.exists(cached_path):
+                self._image_cache.move_to_end(cache_key)
+                return await asyncio.to_thread(Path(cached_path).read_bytes), cached_path
+            
+            if generation is None:
+                img_path = img_path or self.next_image_path()
+                generation = asyncio.create_task(self.write_network_interface(img_path, user_query))
+            
+            image_data = await generation
+            if image_data is None:
                 return None, "No image was generated. The model may not have produced image content."
-                
-            # Extract and save the image
-            image_data = response.candidates[0].content.parts[0].inline_data.data
-            img_path = self.save_image(image_data)
+            
+            self._image_cache[cache_key] = img_path
+            if len(self._image_cache) > self.image_cache_size:
+                self._image_cache.popitem(last=False)
             
             # Update our internal state for the next interaction
             self.current_prompt_state["last_query"] = user_query
-            self.current_prompt_state["last_generated"] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            self.current_prompt_state["last_generated"] = self._now_str()
             
             return image_data, img_path
         except Exception as e:
             print(f"Error generating interface: {str(e)}")
             return None, str(e)
+        finally:
+            if generation is not None and not generation.done():
+                generation.cancel()
 
 # Example usage
 async def main():
@@ -193,11 +354,9 @@ async def main():
             from IPython.display import display, Image as IPythonImage
             display(IPythonImage(data=image_data))
         except ImportError:
-            # Not in a notebook, try to open with PIL
-            try:
-                Image.open(BytesIO(image_data)).show()
-            except Exception as e:
-                print(f"Image saved but could not be displayed automatically: {e}")
+            # Not in a notebook, hand the saved file to the system image viewer
+            if not webbrowser.open(Path(result).resolve().as_uri()):
+                print("Image saved but could not be displayed automatically")
     else:
         print(f"Failed to generate interface: {result}")
     
@@ -215,11 +374,9 @@ async def main():
             from IPython.display import display, Image as IPythonImage
             display(IPythonImage(data=image_data))
         except ImportError:
-            # Not in a notebook, try to open with PIL
-            try:
-                Image.open(BytesIO(image_data)).show()
-            except Exception as e:
-                print(f"Image saved but could not be displayed automatically: {e}")
+            # Not in a notebook, hand the saved file to the system image viewer
+            if not webbrowser.open(Path(result).resolve().as_uri()):
+                print("Image saved but could not be displayed automatically")
     else:
         print(f"Failed to generate detailed view: {result}")
 
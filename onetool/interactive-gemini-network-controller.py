@@ -1,32 +1,201 @@
 import os
+import re
 import sys
-import base64
+import time
+import shutil
+import hashlib
 import asyncio
-import subprocess
+import contextlib
 import socket
 import platform
-from datetime import datetime
-from io import BytesIO
-from PIL import Image
+import webbrowser
+from pathlib import Path
+from types import MappingProxyType
+from functools import cache, cached_property
+from itertools import islice
+from collections import deque
 from google import genai
 from google.genai import types
 
+# Optional: in-process ICMP pings without spawning a ping process per host
+try:
+    from icmplib import async_ping
+except ImportError:
+    async_ping = None
+
+# Splits a user query into words, keeping hyphenated machine names like "headless-server" whole
+_QUERY_TOKEN_RE = re.compile(r"[\w-]+")
+
+# Words in a user query that trigger an operation on the machines it mentions
+_KEYWORD_OPERATIONS = {
+    "ping": "ping",
+    "pings": "ping",
+    "pinging": "ping",
+    "scan": "port scan",
+    "scans": "port scan",
+    "scanning": "port scan",
+    "disk": "check disk space",
+    "disks": "check disk space",
+    "process": "list processes",
+    "processes": "list processes",
+}
+
+# Operations that act on a single machine and need a known target
+_MACHINE_OPERATIONS = frozenset(("ping", "port scan", "check disk space", "list processes"))
+
+# Images are written straight to a raw file descriptor, skipping Python's buffered file layer
+_IMAGE_OPEN_FLAGS = os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, "O_BINARY", 0)
+
+def _write_all(fd, data):
+    """Write every byte of data to a raw file descriptor"""
+    view = memoryview(data)
+    while view:
+        view = view[os.write(fd, view):]
+
+def _write_file(path, data):
+    """Write data to a new file at path, which only appears once it is complete"""
+    tmp_path = f"{path}.part"
+    fd = os.open(tmp_path, _IMAGE_OPEN_FLAGS, 0o644)
+    try:
+        _write_all(fd, data)
+    except BaseException:
+        os.close(fd)
+        os.unlink(tmp_path)
+        raise
+    os.close(fd)
+    os.replace(tmp_path, path)
+
+# How many operations and conversation turns to remember
+_HISTORY_LIMIT = 50
+
+# Shared ping results, so status sweeps that only need the verdict allocate nothing per machine
+_PING_OK = (True, None, None)
+_PING_FAIL = (False, None, None)
+_PING_FAIL_TIMEOUT = (False, None, "Timeout while pinging")
+
+def _get_local_ip():
+    """Get the local IP address"""
+    # Our hostname usually resolves to the address we want without opening a socket
+    try:
+        ip = socket.gethostbyname(socket.gethostname())
+        if not ip.startswith("127."):
+            return ip
+    except OSError:
+        pass
+    
+    # Otherwise ask the kernel which address it would route from
+    try:
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+            s.setblocking(False)
+            # Doesn't need to be reachable
+            s.connect(('10.255.255.255', 1))
+            return s.getsockname()[0]
+    except Exception:
+        return "127.0.0.1"
+
+@cache
+def _get_local_system_info():
+    """Get information about the local system running this code, which doesn't change during a session"""
+    return MappingProxyType({
+        "os": platform.platform(),
+        "hostname": socket.gethostname(),
+        "ip": _get_local_ip(),
+        "python": sys.version
+    })
+
+# Well-known services, used to label open ports
+_COMMON_SERVICES = {
+    22: "SSH",
+    80: "HTTP",
+    443: "HTTPS",
+    21: "FTP",
+    25: "SMTP",
+    53: "DNS",
+    3306: "MySQL",
+    5432: "PostgreSQL",
+    8080: "HTTP-ALT",
+    27017: "MongoDB"
+}
+
+# Only scan a few important ports for the proof of concept
+_SCAN_PORTS = (22, 80, 443, 8080, 3306, 5432)
+
+# Canned results for the simulated operations, built once and shared read-only between calls
+_SIMULATED_DISK_SPACE = MappingProxyType({
+    "total": "500GB",
+    "used": "125GB",
+    "available": "375GB",
+    "percent_used": "25%"
+})
+
+_SIMULATED_PROCESSES = (
+    MappingProxyType({"pid": 1, "name": "systemd", "cpu": "0.1%", "memory": "0.2%"}),
+    MappingProxyType({"pid": 1234, "name": "nginx", "cpu": "0.5%", "memory": "1.2%"}),
+    MappingProxyType({"pid": 5678, "name": "python3", "cpu": "2.5%", "memory": "4.3%"}),
+)
+
+_SIMULATED_TOPOLOGY_NODES = (
+    MappingProxyType({"name": "Router", "ip": "192.168.1.1", "type": "network"}),
+    MappingProxyType({"name": "headless-server", "ip": "192.168.1.53", "type": "server"}),
+    MappingProxyType({"name": "laptop", "ip": "192.168.1.227", "type": "workstation"}),
+)
+
+_SIMULATED_TOPOLOGY_CONNECTIONS = (
+    MappingProxyType({"from": "Router", "to": "headless-server"}),
+    MappingProxyType({"from": "Router", "to": "laptop"}),
+    MappingProxyType({"from": "Router", "to": "controller"}),
+)
+
 class GeminiNetworkOS:
     """
     A fully integrated system where Gemini both creates the interface and controls
     network machines - bypassing traditional UIs entirely.
     """
-    def __init__(self, api_key=None):
-        # Initialize the Gemini client
-        self.client = genai.Client(api_key=api_key or os.environ.get("GEMINI_API_KEY"))
+    # Instructions describing our approach; these never change between calls
+    _SYSTEM_INSTRUCTION = """
+        You are an AI system that IS the operating system interface for a small network.
+        You do not describe or mock up an interface - the images you generate ARE the interface.
+        
+        Your role is to:
+        1. Generate visuals that display network status and the results of operations
+        2. Include all textual content WITHIN the image (not as separate text)
+        3. Use a modern, clean design with a dark mode theme for IT operations
+        4. Highlight machine status with appropriate visual indicators (green for online, red for offline)
+        5. Show the results of the most recent operations prominently
+        6. Include timestamps, IP addresses and any other relevant network information
+        7. Include navigation elements showing the operations that are available
+        
+        You will be given information about machines on a network, the operations that were
+        just executed and the user's request, and should create a complete, finished view.
+        """
+
+    def __init__(self, api_key=None, client=None, image_cache_dir=None, image_cache_size=64, image_cache_max_age=300,
+                 status_ttl=5.0):
+        # Initialize the Gemini client, or share one passed in along with its open connections;
+        # with aiohttp installed, its async calls stream natively on the event loop
+        self.client = client or genai.Client(api_key=api_key or os.environ.get("GEMINI_API_KEY"))
         self.model = "gemini-2.0-flash-exp"  # Model with image generation capabilities
         self.machines = {}
-        self.operations_history = []
+        # Histories keep only the most recent entries so a long session doesn't grow without bound
+        self.operations_history = deque(maxlen=_HISTORY_LIMIT)
         self.img_count = 0
-        self.conversation_history = []
+        self.conversation_history = deque(maxlen=_HISTORY_LIMIT)
+        
+        # Machine status younger than status_ttl seconds is reused instead of re-checked
+        self.status_ttl = status_ttl
+        self._last_check_ts = float("-inf")
+        
+        # Pass image_cache_dir to keep generated images on disk under a hash of what they show.
+        # They have timestamps drawn into them, so they are only reused for image_cache_max_age
+        # seconds, and only the image_cache_size most recently used are kept
+        self.image_cache_dir = image_cache_dir
+        self.image_cache_size = image_cache_size
+        self.image_cache_max_age = image_cache_max_age
+        self._pending_images = {}
         
-        # System information (will be shown in the interface)
-        self.system_info = self._get_local_system_info()
+        # Formatted timestamp, cached for the second it was taken in
+        self._ts_sec = None
+        self._ts_str = None
         
         # Initialize with our known machines
         self.machines["headless-server"] = {
@@ -45,221 +214,492 @@ class GeminiNetworkOS:
             "description": "Main development laptop"
         }
         
-        # Available operations that can be performed
-        self.available_operations = [
-            "ping",
-            "port scan",
-            "check disk space",
-            "list processes",
-            "system overview",
-            "network topology",
-        ]
-
-    def _get_local_system_info(self):
-        """Get information about the local system running this code"""
-        info = {
-            "os": platform.platform(),
-            "hostname": socket.gethostname(),
-            "ip": self._get_local_ip(),
-            "python": sys.version,
-            "time": datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        # Available operations that can be performed, and the handler for each
+        self._ops = {
+            "ping": self._op_ping,
+            "port scan": self._op_port_scan,
+            "check disk space": self._op_disk,
+            "list processes": self._op_processes,
+            "system overview": self._op_overview,
+            "network topology": self._op_topology,
         }
-        return info
-    
-    def _get_local_ip(self):
-        """Get the local IP address"""
-        try:
-            s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-            # Doesn't need to be reachable
-            s.connect(('10.255.255.255', 1))
-            ip = s.getsockname()[0]
-            s.close()
-            return ip
-        except Exception:
-            return "127.0.0.1"
+        self.available_operations = list(self._ops)
+        
+        # Configure the image generation once; it is the same for every request
+        self._generate_content_config = types.GenerateContentConfig(
+            temperature=0.2,
+            top_p=0.95,
+            top_k=40,
+            response_modalities=["image"],
+        )
+        
+        # The instructions and the model's acknowledgement open every conversation unchanged
+        self._conversation_prefix = (
+            types.Content(
+                role="user",
+                parts=[types.Part.from_text(text=self._SYSTEM_INSTRUCTION)]
+            ),
+            types.Content(
+                role="model",
+                parts=[types.Part.from_text(text="I'll generate the network interface directly, showing the current state of your machines and the results of your request.")]
+            ),
+        )
+
+    def _now_str(self):
+        """Current local time as a string, formatted at most once per second"""
+        now = int(time.time())
+        if now != self._ts_sec:
+            self._ts_str = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(now))
+            self._ts_sec = now
+        return self._ts_str
+
+    @property
+    def system_info(self):
+        """Static information about the controller host; the current time comes from _now_str"""
+        return _get_local_system_info()
 
-    def save_image(self, image_data, prefix="network_os"):
-        """Save the generated image to a file"""
+    def next_image_path(self, prefix="network_os"):
+        """Reserve the file name for the next generated image"""
         img_path = f"{prefix}_{self.img_count}.png"
-        with open(img_path, "wb") as f:
-            f.write(image_data)
         self.img_count += 1
         return img_path
 
-    def ping_machine(self, ip_address):
-        """Check if a machine is reachable via ping"""
+    async def ping_machine(self, ip_address, with_output=False):
+        """Check if a machine is reachable via ping, returning (success, output, error)"""
+        if async_ping is not None:
+            try:
+                host = await async_ping(ip_address, count=1, timeout=2, privileged=False)
+            except Exception:
+                # Unprivileged ICMP sockets may be disabled on this system, fall back to the ping command
+                pass
+            else:
+                if not with_output:
+                    return _PING_OK if host.is_alive else _PING_FAIL
+                output = (f"{host.packets_sent} packets transmitted, {host.packets_received} received, "
+                          f"rtt min/avg/max = {host.min_rtt}/{host.avg_rtt}/{host.max_rtt} ms")
+                return host.is_alive, output, None if host.is_alive else f"No reply from {ip_address}"
+        
         try:
-            # Different ping command parameters based on OS
-            param = '-n' if sys.platform.lower() == 'windows' else '-c'
-            command = ['ping', param, '1', ip_address]
+            # Different ping command parameters based on OS; -q keeps the output to the summary lines
+            if sys.platform.lower() == 'windows':
+                command = ['ping', '-n', '1', ip_address]
+            else:
+                command = ['ping', '-q', '-c', '1', ip_address]
+            
+            # Execute the ping command without blocking the event loop, only piping
+            # output back when the caller is going to look at it
+            pipe = asyncio.subprocess.PIPE if with_output else asyncio.subprocess.DEVNULL
+            process = await asyncio.create_subprocess_exec(*command, stdout=pipe, stderr=pipe)
+            try:
+                stdout, stderr = await asyncio.wait_for(process.communicate(), timeout=2)
+            except asyncio.TimeoutError:
+                process.kill()
+                await process.wait()
+                return _PING_FAIL_TIMEOUT
             
-            # Execute the ping command
-            result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=2)
+            if not with_output:
+                return _PING_OK if process.returncode == 0 else _PING_FAIL
             
-            # Return detailed info
-            return {
-                "success": result.returncode == 0,
-                "output": result.stdout.decode('utf-8'),
-                "error": result.stderr.decode('utf-8') if result.returncode != 0 else None
-            }
-        except subprocess.TimeoutExpired:
-            return {"success": False, "output": None, "error": "Timeout while pinging"}
+            # Only decode stderr when the ping actually failed
+            if process.returncode == 0:
+                return True, stdout.decode('utf-8'), None
+            return False, stdout.decode('utf-8'), stderr.decode('utf-8')
         except Exception as e:
-            return {"success": False, "output": None, "error": str(e)}
+            return False, None, str(e)
+
+    async def _probe_port(self, ip_address, port):
+        """Return True if a TCP connection to the port succeeds within 0.1s"""
+        try:
+            _, writer = await asyncio.wait_for(asyncio.open_connection(ip_address, port), timeout=0.1)
+        except (OSError, asyncio.TimeoutError):
+            return False
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except OSError:
+            pass
+        return True
 
-    def scan_ports(self, ip_address, port_range=(1, 1024)):
+    async def scan_ports(self, ip_address, port_range=(1, 1024)):
         """Scan common ports on a machine"""
-        open_ports = []
-        common_services = {
-            22: "SSH",
-            80: "HTTP",
-            443: "HTTPS",
-            21: "FTP",
-            25: "SMTP",
-            53: "DNS",
-            3306: "MySQL",
-            5432: "PostgreSQL",
-            8080: "HTTP-ALT",
-            27017: "MongoDB"
-        }
+        # Probe every port at once, so closed or filtered ports share a single
+        # 0.1s timeout instead of paying one each
+        is_open = await asyncio.gather(*(self._probe_port(ip_address, port) for port in _SCAN_PORTS))
         
-        # Only scan a few important ports for the proof of concept
-        scan_ports = [22, 80, 443, 8080, 3306, 5432]
+        return [{"port": port, "service": _COMMON_SERVICES.get(port, "Unknown")}
+                for port, port_open in zip(_SCAN_PORTS, is_open) if port_open]
+
+    async def _check_one(self, name, now):
+        """Ping one machine and, if it answers, scan its ports, stamping it with the batch time now"""
+        data = self.machines[name]
+        online, _, _ = await self.ping_machine(data["ip"])
+        data["status"] = "online" if online else "offline"
+        data["last_checked"] = now
         
-        for port in scan_ports:
-            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            sock.settimeout(0.1)
-            result = sock.connect_ex((ip_address, port))
-            if result == 0:
-                service = common_services.get(port, "Unknown")
-                open_ports.append({"port": port, "service": service})
-            sock.close()
+        # If online, scan for open ports
+        if online:
+            data["open_ports"] = await self.scan_ports(data["ip"])
         
-        return open_ports
+        # Record this operation
+        self.operations_history.append({
+            "operation": "check_status",
+            "target": name,
+            "timestamp": now,
+            "result": "success" if online else "failed"
+        })
 
-    def check_all_machines(self):
+    async def check_all_machines(self):
         """Check the status of all machines in inventory"""
-        for name, data in self.machines.items():
-            # Check if the machine is reachable
-            ping_result = self.ping_machine(data["ip"])
-            self.machines[name]["status"] = "online" if ping_result["success"] else "offline"
-            self.machines[name]["last_checked"] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            
-            # If online, scan for open ports
-            if ping_result["success"]:
-                open_ports = self.scan_ports(data["ip"])
-                self.machines[name]["open_ports"] = open_ports
-            
-            # Record this operation
-            self.operations_history.append({
-                "operation": "check_status",
-                "target": name,
-                "timestamp": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                "result": "success" if ping_result["success"] else "failed"
-            })
+        # Check every machine concurrently so the sweep costs the slowest machine, not the sum,
+        # and stamp the whole batch with a single timestamp
+        names = list(self.machines)
+        now = self._now_str()
+        results = await asyncio.gather(*(self._check_one(name, now) for name in names), return_exceptions=True)
+        
+        for name, result in zip(names, results):
+            if isinstance(result, Exception):
+                print(f"Error checking {name}: {result}")
+        
+        self._last_check_ts = time.monotonic()
+
+    async def _op_ping(self, target, result):
+        """Ping a machine, keeping ping's output for the interface"""
+        ok, out, err = await self.ping_machine(self.machines[target]["ip"], with_output=True)
+        result["success"] = ok
+        result["data"] = out
+        result["error"] = err
+
+    async def _op_port_scan(self, target, result):
+        """Scan a machine's common ports"""
+        result["data"] = await self.scan_ports(self.machines[target]["ip"])
+        result["success"] = True
+
+    async def _op_disk(self, target, result):
+        """Report disk space on a machine (simulated)"""
+        result["success"] = True
+        result["data"] = _SIMULATED_DISK_SPACE
+
+    async def _op_processes(self, target, result):
+        """List the processes on a machine (simulated)"""
+        result["success"] = True
+        result["data"] = list(_SIMULATED_PROCESSES)
+
+    async def _op_overview(self, target, result):
+        """Check all machines and record their statuses"""
+        await self.check_all_machines()
+        result["success"] = True
+        result["data"] = {name: data["status"] for name, data in self.machines.items()}
+
+    async def _op_topology(self, target, result):
+        """Describe the network topology (simulated)"""
+        result["success"] = True
+        result["data"] = {
+            "nodes": [
+                *_SIMULATED_TOPOLOGY_NODES,
+                {"name": "controller", "ip": self.system_info["ip"], "type": "controller"}
+            ],
+            "connections": list(_SIMULATED_TOPOLOGY_CONNECTIONS)
+        }
 
-    def execute_operation(self, operation, target=None):
+    async def execute_operation(self, operation, target=None):
         """Execute a specific operation on a target machine"""
         result = {
             "operation": operation,
             "target": target,
-            "timestamp": datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            "timestamp": self._now_str(),
             "success": False,
             "data": None,
             "error": None
         }
         
-        try:
-            if operation == "ping":
-                if target in self.machines:
-                    ping_result = self.ping_machine(self.machines[target]["ip"])
-                    result["success"] = ping_result["success"]
-                    result["data"] = ping_result["output"]
-                    result["error"] = ping_result["error"]
-                else:
-                    result["error"] = f"Machine '{target}' not found in inventory"
-            
-            elif operation == "port scan":
-                if target in self.machines:
-                    open_ports = self.scan_ports(self.machines[target]["ip"])
-                    result["success"] = True
-                    result["data"] = open_ports
-                else:
-                    result["error"] = f"Machine '{target}' not found in inventory"
-            
-            elif operation == "check disk space":
-                # This is a simulated operation
-                if target in self.machines:
-                    result["success"] = True
-                    result["data"] = {
-                        "total": "500GB",
-                        "used": "125GB",
-                        "available": "375GB",
-                        "percent_used": "25%"
-                    }
+        handler = self._ops.get(operation)
+        if handler is None:
+            result["error"] = f"Unknown operation: {operation}"
+        elif operation in _MACHINE_OPERATIONS and target not in self.machines:
+            result["error"] = f"Machine '{target}' not found in inventory"
+        else:
+            try:
+                await handler(target, result)
+            except Exception as e:
+                result["error"] = str(e)
+        
+        # Record this operation in history
+        self.operations_history.append(result)
+        return result
+
+    @cached_property
+    def _prompt_preamble(self):
+        """The start of every prompt, which only depends on this controller"""
+        return f"""IMPORTANT: You ARE the interface. The image you generate IS the actual screen the user
+        is looking at, so it should look like a finished application, not a sketch or wireframe.
+        
+        Available Operations: {", ".join(self.available_operations)}
+        Controller: {self.system_info['hostname']} ({self.system_info['ip']})"""
+
+    def _machine_status_lines(self):
+        """Yield the prompt lines describing each machine, with a blank line after each"""
+        for name, data in self.machines.items():
+            status = data["status"]
+            yield f"Machine: {name}"
+            yield f"IP: {data['ip']}"
+            yield f"OS: {data['os']}"
+            yield f"Description: {data['description']}"
+            yield f"Status: {status} (colored {'green' if status == 'online' else 'red'})"
+            if "last_checked" in data:
+                yield f"Last Checked: {data['last_checked']}"
+            if data.get("open_ports"):
+                yield "Open Ports: " + ", ".join(f"{p['port']} ({p['service']})" for p in data["open_ports"])
+            yield ""
+
+    @staticmethod
+    def _operation_outcome(op):
+        """How an operation turned out, as shown in the prompt"""
+        return op.get("result") or ("success" if op.get("success") else f"failed ({op.get('error')})")
+
+    def _recent_operation_lines(self, count=5):
+        """Yield one prompt line for each of the most recent operations"""
+        history = self.operations_history
+        for op in islice(history, max(len(history) - count, 0), None):
+            yield f"- {op['operation']} on {op['target'] or 'network'} at {op['timestamp']}: {self._operation_outcome(op)}"
+
+    async def _prepare_interface(self, user_query=None):
+        """Run the operations a query asks for, refresh machine status and build the image prompt,
+        returning the prompt and the results of the operations that were run"""
+        ran = []
+        if user_query:
+            # Process the user query to execute relevant operations, lowercasing it once and
+            # sorting every word into machines, operations or other keywords in a single pass
+            targets = {}
+            operations = {}
+            tokens = set()
+            for word in _QUERY_TOKEN_RE.findall(user_query.lower()):
+                if word in self.machines:
+                    targets[word] = None
+                elif word in _KEYWORD_OPERATIONS:
+                    operations[_KEYWORD_OPERATIONS[word]] = None
                 else:
-                    result["error"] = f"Machine '{target}' not found in inventory"
+                    tokens.add(word)
             
-            elif operation == "list processes":
-                # This is a simulated operation
-                if target in self.machines:
-                    result["success"] = True
-                    result["data"] = [
-                        {"pid": 1, "name": "systemd", "cpu": "0.1%", "memory": "0.2%"},
-                        {"pid": 1234, "name": "nginx", "cpu": "0.5%", "memory": "1.2%"},
-                        {"pid": 5678, "name": "python3", "cpu": "2.5%", "memory": "4.3%"}
-                    ]
-                else:
-                    result["error"] = f"Machine '{target}' not found in inventory"
+            if targets and operations:
+                for operation in operations:
+                    for machine in targets:
+                        ran.append(await self.execute_operation(operation, machine))
             
-            elif operation == "system overview":
-                # Check all machines
-                self.check_all_machines()
-                result["success"] = True
-                result["data"] = {name: data for name, data in self.machines.items()}
+            elif "topology" in tokens:
+                ran.append(await self.execute_operation("network topology"))
             
-            elif operation == "network topology":
-                # Generate a simulated network topology
-                result["success"] = True
-                result["data"] = {
-                    "nodes": [
-                        {"name": "Router", "ip": "192.168.1.1", "type": "network"},
-                        {"name": "headless-server", "ip": "192.168.1.53", "type": "server"},
-                        {"name": "laptop", "ip": "192.168.1.227", "type": "workstation"},
-                        {"name": "controller", "ip": self.system_info["ip"], "type": "controller"}
-                    ],
-                    "connections": [
-                        {"from": "Router", "to": "headless-server"},
-                        {"from": "Router", "to": "laptop"},
-                        {"from": "Router", "to": "controller"}
-                    ]
-                }
-            else:
-                result["error"] = f"Unknown operation: {operation}"
+            elif "overview" in tokens or "status" in tokens:
+                ran.append(await self.execute_operation("system overview"))
         
-        except Exception as e:
-            result["error"] = str(e)
+        # Refresh the status of our machines, unless an operation above just did
+        if time.monotonic() - self._last_check_ts >= self.status_ttl:
+            await self.check_all_machines()
         
-        # Record this operation in history
-        self.operations_history.append(result)
-        return result
+        # Format current machine status and the most recent operations
+        machine_status = "\n".join(self._machine_status_lines())
+        recent_operations = "\n".join(self._recent_operation_lines())
+        
+        # Create the full prompt for image generation
+        action_prompt = user_query if user_query else "Show me an overview of my network"
+        
+        # Fixed wording goes first and the values that change every call go last,
+        # so consecutive requests share as long a prefix as possible
+        complete_prompt = f"""
+        {self._prompt_preamble}
+        
+        Request: {action_prompt}
+        
+        Network Machines Status:
+        {machine_status}
+        
+        Recent Operations:
+        {recent_operations or 'No operations performed yet.'}
+        
+        Current Time: {self._now_str()}
+        """
+        
+        return complete_prompt, ran
+
+    def _interface_key(self, user_query, ran):
+        """Hash the query, the machine states and how the operations it ran turned out, leaving out
+        timestamps, so asking again for an unchanged view gives the same key"""
+        state = "\n".join((
+            user_query or "",
+            *(f"{name} {data['status']} {[p['port'] for p in data.get('open_ports') or ()]}"
+              for name, data in self.machines.items()),
+            *(f"{op['operation']} {op['target']} {self._operation_outcome(op)}" for op in ran),
+        ))
+        return hashlib.blake2b(state.encode(), digest_size=16).hexdigest()
+
+    async def stream_interface(self, user_query=None):
+        """Generate a visual interface, yielding each image as it streams in from Gemini"""
+        complete_prompt, _ = await self._prepare_interface(user_query)
+        async for image_chunk in self._stream_prompt(complete_prompt):
+            yield image_chunk
+
+    async def _stream_prompt(self, complete_prompt):
+        """Yield each image Gemini streams back for a prepared prompt"""
+        # Only the final turn changes between calls; the preamble is shared
+        contents = [
+            *self._conversation_prefix,
+            types.Content(
+                role="user",
+                parts=[types.Part.from_text(text=complete_prompt)]
+            )
+        ]
+        
+        # Generate the image, handing each one to the caller as soon as it arrives; every
+        # inline_data part is a complete image, not a piece of one
+        # Closing the stream on the way out releases its connection, even if we stop reading early
+        async with contextlib.aclosing(await self.client.aio.models.generate_content_stream(
+            model=self.model,
+            contents=contents,
+            config=self._generate_content_config,
+        )) as stream:
+            async for chunk in stream:
+                candidates = chunk.candidates
+                if not candidates:
+                    continue
+                content = candidates[0].content
+                if not content or not content.parts:
+                    continue
+                
+                inline_data = getattr(content.parts[0], 'inline_data', None)
+                if inline_data:
+                    yield inline_data.data
 
     async def generate_interface(self, user_query=None):
         """Generate a visual interface using Gemini based on network status and user input"""
-        # Prepare conversation for generating the image
-        if user_query:
-            # Process the user query to execute relevant operations
-            if "ping" in user_query.lower() and any(machine in user_query.lower() for machine in self.machines):
-                for machine in self.machines:
-                    if machine in user_query.lower():
-                        self.execute_operation("ping", machine)
+        # Identical requests made while one is still running share its operations and its result
+        query = user_query or ""
+        pending = self._pending_images.get(query)
+        if pending is None:
+            pending = self._pending_images[query] = asyncio.ensure_future(self._generate_interface(user_query))
+            pending.add_done_callback(lambda _: self._pending_images.pop(query, None))
+        return await asyncio.shield(pending)
+
+    async def _generate_interface(self, user_query):
+        """Run a query's operations and produce its interface image, reusing a cached one for an unchanged view"""
+        try:
+            complete_prompt, ran = await self._prepare_interface(user_query)
             
-            elif "scan" in user_query.lower() and any(machine in user_query.lower() for machine in self.machines):
-                for machine in self.machines:
-                    if machine in user_query.lower():
-                        self.execute_operation("port scan", machine)
+            # Identical views share one image
+            image_data = cache_path = None
+            if self.image_cache_dir:
+                key = self._interface_key(user_query, ran)
+                cache_path = os.path.join(self.image_cache_dir, f"{key}.png")
+                image_data = await asyncio.to_thread(self._read_cached_image, cache_path)
+            
+            if image_data is not None:
+                img_path = cache_path
+            else:
+                image_data, img_path = await self._write_interface(complete_prompt)
+                if image_data is None:
+                    return None, "No image was generated. The model may not have produced image content."
+                if cache_path:
+                    await asyncio.to_thread(self._store_cached_image, img_path, cache_path)
             
-            elif "disk" in user_query.lower() and any(machine in user_query.lower() for machine in self.machines):
-                for machine in self.machines:
-                    if machine in user_query.lower():
-                        self.execute_operation("
\ No newline at end of file
+            # Remember this interaction for the next turn
+            self.conversation_history.append({
+                "query": user_query,
+                "image": img_path,
+                "timestamp": self._now_str()
+            })
+            
+            return image_data, img_path
+        except Exception as e:
+            print(f"Error generating interface: {str(e)}")
+            return None, str(e)
+
+    async def _write_interface(self, complete_prompt):
+        """Save the first image Gemini returns for a prepared prompt, returning (image_data, img_path)"""
+        # If the model sends several images we keep the first and stop reading
+        async with contextlib.aclosing(self._stream_prompt(complete_prompt)) as images:
+            async for image_data in images:
+                img_path = self.next_image_path()
+                await asyncio.to_thread(_write_file, img_path, image_data)
+                return image_data, img_path
+        return None, None
+
+    def _read_cached_image(self, cache_path):
+        """Return the cached image at cache_path if it is younger than image_cache_max_age, or None"""
+        try:
+            st = os.stat(cache_path)
+            if time.time() - st.st_mtime >= self.image_cache_max_age:
+                return None
+            image_data = Path(cache_path).read_bytes()
+            # The access time records when the image was last used, for eviction; the
+            # modification time keeps recording when it was generated
+            os.utime(cache_path, (time.time(), st.st_mtime))
+        except OSError:
+            return None
+        return image_data
+
+    def _store_cached_image(self, img_path, cache_path):
+        """Keep a copy of a generated image in the on-disk cache, so later runs can reuse it"""
+        try:
+            os.makedirs(self.image_cache_dir, exist_ok=True)
+            # An expired entry may be a hard link to an earlier image, so unlink it rather than overwrite it
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(cache_path)
+            try:
+                os.link(img_path, cache_path)
+            except OSError:
+                shutil.copyfile(img_path, cache_path)
+            self._prune_image_cache()
+        except OSError as e:
+            print(f"Could not cache {img_path}: {e}")
+
+    def _prune_image_cache(self):
+        """Delete expired cached images, then the least recently used beyond image_cache_size"""
+        expired_before = time.time() - self.image_cache_max_age
+        images = []
+        with os.scandir(self.image_cache_dir) as entries:
+            for entry in entries:
+                if not entry.name.endswith(".png"):
+                    continue
+                st = entry.stat()
+                if st.st_mtime < expired_before:
+                    with contextlib.suppress(OSError):
+                        os.unlink(entry.path)
+                else:
+                    images.append((st.st_atime, entry.path))
+        if len(images) <= self.image_cache_size:
+            return
+        images.sort()
+        for _, path in images[:len(images) - self.image_cache_size]:
+            with contextlib.suppress(OSError):
+                os.unlink(path)
+
+# Example usage
+async def main():
+    # Initialize the network OS
+    network_os = GeminiNetworkOS()
+    
+    print("Gemini Network OS - describe what you want to see or do (type 'exit' to quit)")
+    user_query = None
+    
+    while True:
+        print("Generating interface...")
+        image_data, result = await network_os.generate_interface(user_query)
+        
+        if image_data:
+            print(f"Generated interface saved to: {result}")
+            
+            # Display the image if in a notebook environment
+            try:
+                from IPython.display import display, Image as IPythonImage
+                display(IPythonImage(data=image_data))
+            except ImportError:
+                # Not in a notebook, hand the saved file to the system image viewer
+                if not webbrowser.open(Path(result).resolve().as_uri()):
+                    print("Image saved but could not be displayed automatically")
+        else:
+            print(f"Failed to generate interface: {result}")
+        
+        user_query = input("\n> ").strip()
+        if user_query.lower() in ("exit", "quit"):
+            break
+
+if __name__ == "__main__":
+    asyncio.run(main())
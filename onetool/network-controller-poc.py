@@ -1,47 +1,228 @@
 import os
-import base64
+import json
+import time
+import sqlite3
+import string
+import hashlib
+import textwrap
 import asyncio
-import paramiko
-from PIL import Image
-from io import BytesIO
-from datetime import datetime
+import threading
+import contextlib
+import webbrowser
+from pathlib import Path
+import asyncssh
 from google import genai
 from google.genai import types
 
+# Images are written straight to a raw file descriptor, skipping Python's buffered file layer
+_IMAGE_OPEN_FLAGS = os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, "O_BINARY", 0)
+
+def _write_all(fd, data):
+    """Write every byte of data to a raw file descriptor"""
+    view = memoryview(data)
+    while view:
+        view = view[os.write(fd, view):]
+
+def _write_file(path, data):
+    """Write data to a new file at path, which only appears once it is complete"""
+    tmp_path = f"{path}.part"
+    fd = os.open(tmp_path, _IMAGE_OPEN_FLAGS, 0o644)
+    try:
+        _write_all(fd, data)
+    except BaseException:
+        os.close(fd)
+        os.unlink(tmp_path)
+        raise
+    os.close(fd)
+    os.replace(tmp_path, path)
+
+# Commands run to describe a machine
+_SYSTEM_INFO_COMMANDS = {
+    "hostname": "hostname",
+    "cpu_info": "lscpu | grep 'Model name' | cut -d: -f2 | sed 's/^ *//'",
+    "memory": "free -h | grep Mem | awk '{print $2}'",
+    "disk": "df -h / | awk 'NR==2 {print $2}'",
+    "uptime": "uptime -p",
+    "load": "uptime | awk -F'load average:' '{ print $2 }'",
+    "processes": "ps aux | wc -l",
+    "distro": "cat /etc/os-release | grep PRETTY_NAME | cut -d= -f2 | tr -d '\"'"
+}
+
+# How many seconds each command's output stays valid; hardware and OS details barely change
+_SYSTEM_INFO_TTL = {
+    "hostname": 86400,
+    "cpu_info": 86400,
+    "distro": 86400,
+    "memory": 60,
+    "disk": 60,
+    "uptime": 5,
+    "load": 5,
+    "processes": 5,
+}
+
+# Cache entry for a command that has never run
+_NEVER = (float("-inf"), None)
+
+# System info that changes on every refresh; it is left out of response cache keys, so a
+# cached dashboard can show values up to the cache's max_age old
+_VOLATILE_INFO = frozenset(("uptime", "load", "processes"))
+
+class ResponseCache:
+    """Generated images kept in SQLite for max_age seconds, keyed by a hash of the request that produced them"""
+    def __init__(self, path, max_age=300):
+        # The cache is used from worker threads so the event loop never waits on the
+        # database; the lock keeps them from using the connection at the same time
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        self.max_age = max_age
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS images (key TEXT PRIMARY KEY, data BLOB, mime_type TEXT, created REAL)"
+        )
+
+    @staticmethod
+    def make_key(model, config, texts):
+        """Hash the model, generation settings and every text sent to it into a cache key"""
+        request = {
+            "model": model,
+            "cfg": config.model_dump(mode="json", exclude_none=True),
+            "texts": [" ".join(text.split()) for text in texts],
+        }
+        return hashlib.sha256(json.dumps(request, sort_keys=True).encode()).hexdigest()
+
+    def get(self, key):
+        """Return (data, mime_type) stored under key, or None if there is none younger than max_age"""
+        with self._lock:
+            return self.conn.execute(
+                "SELECT data, mime_type FROM images WHERE key = ? AND created >= ?",
+                (key, time.time() - self.max_age)
+            ).fetchone()
+
+    def put(self, key, data, mime_type):
+        """Store a generated response under key, dropping any that have expired"""
+        now = time.time()
+        with self._lock, self.conn:
+            self.conn.execute("DELETE FROM images WHERE created < ?", (now - self.max_age,))
+            self.conn.execute("INSERT OR REPLACE INTO images VALUES (?, ?, ?, ?)", (key, data, mime_type, now))
+
+    def close(self):
+        """Close the database"""
+        with self._lock:
+            self.conn.close()
+
 class NetworkController:
     """
     A system that uses Gemini to generate visual interfaces and control network machines
     directly through SSH connections, bypassing traditional UI interaction.
     """
-    def __init__(self, api_key=None):
-        # Initialize the Gemini client
-        self.client = genai.Client(api_key=api_key or os.environ.get("GEMINI_API_KEY"))
+    # Instructions describing our approach; these never change between calls
+    _SYSTEM_INSTRUCTION = """
+        You are a specialized AI that creates informative, clear dashboards for IT and network management. 
+        Your visuals should:
+        1. Use a clean, professional design with a dark mode theme
+        2. Include all relevant system status information clearly labeled
+        3. Highlight critical information or alerts with appropriate colors (red for errors, yellow for warnings)
+        4. Use a consistent layout with proper spacing and alignment
+        5. Include a timestamp of when the data was collected
+        6. Generate text as part of the image (not separate) that's readable and properly sized
+        7. Use icons where appropriate to enhance readability
+        
+        Your UI should be complete and ready to present to users with no additional processing needed.
+        """
+
+    # Fixed wording goes first and the values that change every call go last,
+    # so consecutive requests share a long prefix
+    _PROMPT_TEMPLATE = string.Template(textwrap.dedent("""
+        Create a dashboard interface that displays this information clearly and professionally.
+
+        $prompt
+
+        Network Machines:
+        $machines
+
+        Additional Context:
+        $ctx
+
+        Current Time: $timestamp
+        """))
+
+    def __init__(self, api_key=None, client=None, max_ssh_sessions=16, cache_path=None, cache_max_age=300):
+        # Initialize the Gemini client, or share one passed in along with its open connections;
+        # with aiohttp installed, its async calls stream natively on the event loop
+        self.client = client or genai.Client(api_key=api_key or os.environ.get("GEMINI_API_KEY"))
         self.model = "gemini-2.0-flash-exp"  # Model with image generation capabilities
         self.machines = {}
         self.ssh_connections = {}
+        # Formatted timestamp, cached for the second it was taken in
+        self._ts_sec = None
+        self._ts_str = None
+        # Latest output of each system info command, keyed by (machine, field)
+        self._info_cache = {}
+        # Caps how many machines are queried over SSH at once
+        self._ssh_sem = asyncio.Semaphore(max_ssh_sessions)
         self.img_count = 0
+        # Pass cache_path to keep generated images in SQLite and reuse them for repeat requests
+        self.response_cache = ResponseCache(cache_path, cache_max_age) if cache_path else None
+        
+        # Configure the image generation once; it is the same for every request
+        self._generate_content_config = types.GenerateContentConfig(
+            temperature=0.2,
+            top_p=0.95,
+            top_k=40,
+            response_modalities=["image"],
+        )
+        
+        # The instructions and the model's acknowledgement open every conversation unchanged
+        self._conversation_prefix = (
+            types.Content(
+                role="user",
+                parts=[types.Part.from_text(text=self._SYSTEM_INSTRUCTION)]
+            ),
+            types.Content(
+                role="model",
+                parts=[types.Part.from_text(text="I'll generate a clean, professional dashboard with all the network information.")]
+            ),
+        )
 
-    def add_machine(self, name, ip, username, password=None, key_file=None):
-        """Add a machine to the controller's inventory"""
+    def _now_str(self):
+        """Current local time as a string, formatted at most once per second"""
+        now = int(time.time())
+        if now != self._ts_sec:
+            self._ts_str = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(now))
+            self._ts_sec = now
+        return self._ts_str
+
+    def add_machine(self, name, ip, username, password=None, key_file=None, options=None):
+        """Add a machine to the controller's inventory, optionally with asyncssh.SSHClientConnectionOptions"""
         self.machines[name] = {
             "ip": ip,
             "username": username,
             "password": password,
             "key_file": key_file,
+            "options": options,
             "status": "disconnected",
             "info": {}
         }
         return self
 
-    def save_image(self, image_data, prefix="gemini_ui"):
-        """Save the generated image to a file"""
+    def next_image_path(self, prefix="gemini_ui"):
+        """Reserve the file name for the next generated image"""
         img_path = f"{prefix}_{self.img_count}.png"
-        with open(img_path, "wb") as f:
-            f.write(image_data)
         self.img_count += 1
         return img_path
 
-    def connect_to_machine(self, machine_name):
+    def save_image(self, image_data, prefix="gemini_ui"):
+        """Save the generated image to a file"""
+        img_path = self.next_image_path(prefix)
+        _write_file(img_path, image_data)
+        return img_path
+
+    async def save_image_async(self, image_data, prefix="gemini_ui"):
+        """Save the generated image to a file without blocking the event loop"""
+        img_path = self.next_image_path(prefix)
+        await asyncio.to_thread(_write_file, img_path, image_data)
+        return img_path
+
+    async def connect_to_machine(self, machine_name):
         """Establish SSH connection to a specified machine"""
         if machine_name not in self.machines:
             raise ValueError(f"Machine {machine_name} not in inventory")
@@ -49,22 +230,19 @@ class NetworkController:
         machine = self.machines[machine_name]
         
         try:
-            client = paramiko.SSHClient()
-            client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-            
-            # Connect using password or key file
+            # Connect using password or key file; host keys aren't checked, as with the POC's old auto-add policy
             if machine["key_file"]:
-                client.connect(
-                    machine["ip"],
-                    username=machine["username"],
-                    key_filename=machine["key_file"]
-                )
+                credentials = {"client_keys": [machine["key_file"]]}
             else:
-                client.connect(
-                    machine["ip"],
-                    username=machine["username"],
-                    password=machine["password"]
-                )
+                credentials = {"password": machine["password"]}
+            client = await asyncssh.connect(
+                machine["ip"],
+                username=machine["username"],
+                known_hosts=None,
+                connect_timeout=5,
+                options=machine["options"],
+                **credentials
+            )
             
             self.ssh_connections[machine_name] = client
             self.machines[machine_name]["status"] = "connected"
@@ -74,137 +252,183 @@ class NetworkController:
             self.machines[machine_name]["status"] = f"error: {str(e)}"
             return False
 
-    def execute_command(self, machine_name, command):
+    async def execute_command(self, machine_name, command):
         """Execute a command on a connected machine"""
-        if machine_name not in self.ssh_connections:
-            if not self.connect_to_machine(machine_name):
-                return {"error": f"Cannot connect to {machine_name}"}
-        
-        client = self.ssh_connections[machine_name]
-        
-        try:
-            stdin, stdout, stderr = client.exec_command(command)
-            result = stdout.read().decode('utf-8')
-            error = stderr.read().decode('utf-8')
+        # Reuse the already-authenticated connection when there is one; if it has gone
+        # stale, drop it and pay for a fresh handshake once
+        for attempt in range(2):
+            client = self.ssh_connections.get(machine_name)
+            if client is not None and client.is_closed():
+                await self.close_connection(machine_name)
+                client = None
+            if client is None:
+                if not await self.connect_to_machine(machine_name):
+                    return {"error": f"Cannot connect to {machine_name}"}
+                client = self.ssh_connections[machine_name]
+            
+            try:
+                process = await client.create_process(command)
+            except asyncssh.ChannelOpenError as e:
+                # The channel never opened, so the command didn't start and is safe to retry
+                await self.close_connection(machine_name)
+                if attempt:
+                    return {"error": str(e)}
+                continue
+            except Exception as e:
+                return {"error": str(e)}
+            
+            try:
+                result = await process.wait(check=False)
+            except Exception as e:
+                # The command may already have run, so it is not sent a second time
+                await self.close_connection(machine_name)
+                return {"error": str(e)}
             
             return {
-                "stdout": result,
-                "stderr": error,
-                "success": not error
+                "stdout": result.stdout,
+                "stderr": result.stderr,
+                "success": not result.stderr
             }
-        except Exception as e:
-            return {"error": str(e)}
-
-    def get_system_info(self, machine_name):
-        """Get system information from a machine"""
-        commands = {
-            "hostname": "hostname",
-            "cpu_info": "lscpu | grep 'Model name' | cut -d: -f2 | sed 's/^ *//'",
-            "memory": "free -h | grep Mem | awk '{print $2}'",
-            "disk": "df -h / | awk 'NR==2 {print $2}'",
-            "uptime": "uptime -p",
-            "load": "uptime | awk -F'load average:' '{ print $2 }'",
-            "processes": "ps aux | wc -l",
-            "distro": "cat /etc/os-release | grep PRETTY_NAME | cut -d= -f2 | tr -d '\"'"
-        }
+
+    async def close_connection(self, machine_name):
+        """Close and forget the SSH connection to a machine"""
+        client = self.ssh_connections.pop(machine_name, None)
+        if client is None:
+            return
+        client.close()
+        try:
+            await client.wait_closed()
+        except Exception:
+            pass
+        self.machines[machine_name]["status"] = "disconnected"
+
+    async def close_all(self):
+        """Close every open SSH connection"""
+        await asyncio.gather(*(self.close_connection(name) for name in list(self.ssh_connections)))
+
+    async def get_system_info(self, machine_name):
+        """Get system information from a machine, only re-running commands whose last result has expired"""
+        now = time.monotonic()
+        stale = {key: cmd for key, cmd in _SYSTEM_INFO_COMMANDS.items()
+                 if now - self._info_cache.get((machine_name, key), _NEVER)[0] >= _SYSTEM_INFO_TTL[key]}
+        
+        if stale:
+            # Run every command in a single exec so the machine costs one SSH round-trip, not one per command
+            async with self._ssh_sem:
+                cmd_result = await self.execute_command(machine_name, "; echo ---SEP---; ".join(stale.values()))
+            
+            if "error" in cmd_result:
+                # Forget the expired values instead of passing them off as current when a machine stops answering
+                for key in stale:
+                    self._info_cache.pop((machine_name, key), None)
+            else:
+                outputs = cmd_result["stdout"].split("---SEP---")
+                for key, output in zip(stale, outputs):
+                    self._info_cache[machine_name, key] = (now, output.strip())
         
         results = {}
-        for key, cmd in commands.items():
-            cmd_result = self.execute_command(machine_name, cmd)
-            if "error" not in cmd_result:
-                results[key] = cmd_result["stdout"].strip()
+        for key in _SYSTEM_INFO_COMMANDS:
+            cached = self._info_cache.get((machine_name, key))
+            if cached:
+                results[key] = cached[1]
         
         self.machines[machine_name]["info"] = results
         return results
 
-    async def generate_interface(self, prompt, context=None):
-        """Generate a visual interface using Gemini"""
-        system_instruction = """
-        You are a specialized AI that creates informative, clear dashboards for IT and network management. 
-        Your visuals should:
-        1. Use a clean, professional design with a dark mode theme
-        2. Include all relevant system status information clearly labeled
-        3. Highlight critical information or alerts with appropriate colors (red for errors, yellow for warnings)
-        4. Use a consistent layout with proper spacing and alignment
-        5. Include a timestamp of when the data was collected
-        6. Generate text as part of the image (not separate) that's readable and properly sized
-        7. Use icons where appropriate to enhance readability
-        
-        Your UI should be complete and ready to present to users with no additional processing needed.
-        """
-        
-        # Format machine data for display
-        machines_data = ""
+    def _machine_lines(self, skip=frozenset()):
+        """Yield the prompt lines describing each machine, with a blank line after each, leaving out info keys in skip"""
         for name, data in self.machines.items():
-            machines_data += f"Machine: {name} ({data['ip']})\n"
-            machines_data += f"Status: {data['status']}\n"
+            yield f"Machine: {name} ({data['ip']})"
+            yield f"Status: {data['status']}"
             
             if data["info"]:
-                machines_data += "System Information:\n"
+                yield "System Information:"
                 for key, value in data["info"].items():
-                    machines_data += f"  - {key}: {value}\n"
-            machines_data += "\n"
+                    if key not in skip:
+                        yield f"  - {key}: {value}"
+            yield ""
+
+    async def refresh_all(self):
+        """Get system information from every machine concurrently"""
+        names = list(self.machines)
+        results = await asyncio.gather(*(self.get_system_info(name) for name in names),
+                                       return_exceptions=True)
+        for name, result in zip(names, results):
+            if isinstance(result, Exception):
+                print(f"Could not connect to {name}: {result}")
+
+    async def generate_interface(self, prompt, context=None):
+        """Generate a visual interface using Gemini"""
+        # Format machine data for display
+        machines_data = "\n".join(self._machine_lines())
         
         # Create content for generating the image
-        complete_prompt = f"""
-        {prompt}
-        
-        Current Time: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
-        
-        Network Machines:
-        {machines_data}
-        
-        Additional Context:
-        {context or 'No additional context provided.'}
-        
-        Create a dashboard interface that displays this information clearly and professionally.
-        """
-
-        generate_content_config = types.GenerateContentConfig(
-            temperature=0.2,
-            top_p=0.95,
-            top_k=40,
-            response_modalities=["image"],
+        complete_prompt = self._PROMPT_TEMPLATE.substitute(
+            prompt=prompt,
+            machines=machines_data,
+            ctx=context or 'No additional context provided.',
+            timestamp=self._now_str(),
         )
 
+        # Only the final turn changes between calls; the preamble is shared
         contents = [
-            types.Content(
-                role="user",
-                parts=[types.Part.from_text(text=system_instruction)]
-            ),
-            types.Content(
-                role="model",
-                parts=[types.Part.from_text(text="I'll generate a clean, professional dashboard with all the network information.")]
-            ),
+            *self._conversation_prefix,
             types.Content(
                 role="user",
                 parts=[types.Part.from_text(text=complete_prompt)]
             )
         ]
 
-        # Generate the image
         try:
-            response = None
-            async for chunk in self.client.aio.models.generate_content_stream(
+            # The key covers the whole conversation we would send, except the timestamp and the
+            # system info that changes on every refresh, which would make every key unique
+            cache_key = None
+            if self.response_cache:
+                key_prompt = self._PROMPT_TEMPLATE.substitute(
+                    prompt=prompt,
+                    machines="\n".join(self._machine_lines(skip=_VOLATILE_INFO)),
+                    ctx=context or 'No additional context provided.',
+                    timestamp="",
+                )
+                cache_key = ResponseCache.make_key(
+                    self.model, self._generate_content_config,
+                    [*(part.text for turn in self._conversation_prefix for part in turn.parts), key_prompt]
+                )
+                cached = await asyncio.to_thread(self.response_cache.get, cache_key)
+                if cached:
+                    image_data = cached[0]
+                    img_path = await self.save_image_async(image_data)
+                    return image_data, img_path
+            
+            # Generate the image
+            inline_data = None
+            # We stop reading as soon as the image arrives; leaving the block closes the stream,
+            # so the rest of the response isn't downloaded and its connection is released
+            async with contextlib.aclosing(await self.client.aio.models.generate_content_stream(
                 model=self.model,
                 contents=contents,
-                config=generate_content_config,
-            ):
-                if (not chunk.candidates or not chunk.candidates[0].content or 
-                    not chunk.candidates[0].content.parts):
-                    continue
-                
-                if chunk.candidates[0].content.parts[0].inline_data:
-                    response = chunk
-                    break
+                config=self._generate_content_config,
+            )) as stream:
+                async for chunk in stream:
+                    candidates = chunk.candidates
+                    if not candidates:
+                        continue
+                    content = candidates[0].content
+                    if not content or not content.parts:
+                        continue
+                    
+                    inline_data = getattr(content.parts[0], 'inline_data', None)
+                    if inline_data:
+                        break
             
-            if not response:
+            if not inline_data:
                 return None, "No image generated"
                 
             # Extract and save the image
-            image_data = response.candidates[0].content.parts[0].inline_data.data
-            mime_type = response.candidates[0].content.parts[0].inline_data.mime_type
-            img_path = self.save_image(image_data)
+            image_data = inline_data.data
+            if cache_key:
+                await asyncio.to_thread(self.response_cache.put, cache_key, image_data, inline_data.mime_type)
+            img_path = await self.save_image_async(image_data)
             
             return image_data, img_path
         except Exception as e:
@@ -231,20 +455,17 @@ async def main():
         password="password"  # Replace with actual password or use key_file
     )
     
-    # Try to get system info (this will attempt connection)
-    try:
-        controller.get_system_info("headless-server")
-    except Exception as e:
-        print(f"Could not connect to headless-server: {e}")
-    
-    try:
-        controller.get_system_info("laptop")
-    except Exception as e:
-        print(f"Could not connect to laptop: {e}")
+    # Try to get system info from both machines at once (this will attempt connection)
+    await controller.refresh_all()
     
     # Generate the interface visualization
     prompt = "Show me the status dashboard for my network machines"
-    image_data, img_path = await controller.generate_interface(prompt)
+    try:
+        image_data, img_path = await controller.generate_interface(prompt)
+    finally:
+        await controller.close_all()
+        if controller.response_cache:
+            controller.response_cache.close()
     
     if image_data:
         print(f"Generated interface saved to: {img_path}")
@@ -254,10 +475,8 @@ async def main():
             from IPython.display import display, Image as IPythonImage
             display(IPythonImage(data=image_data))
         except ImportError:
-            # Not in a notebook, open the file
-            try:
-                Image.open(BytesIO(image_data)).show()
-            except:
+            # Not in a notebook, hand the saved file to the system image viewer
+            if not webbrowser.open(Path(img_path).resolve().as_uri()):
                 print("Image saved but could not be displayed automatically")
     else:
         print(f"Failed to generate interface: {img_path}")
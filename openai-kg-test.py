@@ -6,6 +6,12 @@ import json
 import sys
 from dotenv import load_dotenv
 
+# Optional: orjson parses the model's JSON responses several times faster than the json module
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    json_loads = json.loads
+
 # Load environment variables from .env file
 load_dotenv()
 
@@ -19,9 +25,173 @@ if not api_key:
 # Initialize OpenAI client
 client = openai.OpenAI(api_key=api_key)
 
+# Node and edge attributes that tell their graph when they are edited in place
+class _AttrDict(dict):
+    def __init__(self, on_change=None):
+        super().__init__()
+        self._on_change = on_change
+
+    def _changed(self):
+        on_change = getattr(self, "_on_change", None)
+        if on_change is not None:
+            on_change()
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self._changed()
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self._changed()
+
+    def __ior__(self, other):
+        super().__ior__(other)
+        self._changed()
+        return self
+
+    def update(self, *args, **kwargs):
+        super().update(*args, **kwargs)
+        self._changed()
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def pop(self, *args):
+        value = super().pop(*args)
+        self._changed()
+        return value
+
+    def popitem(self):
+        item = super().popitem()
+        self._changed()
+        return item
+
+    def clear(self):
+        super().clear()
+        self._changed()
+
+# A directed graph that keeps its text representation up to date as it grows, so describing
+# it to the LLM doesn't re-serialize every node and edge. Attributes edited in place, like
+# G.nodes[n]['label'] = ..., can't be tracked per node, so they rebuild the text once
+class CachedGraph(nx.DiGraph):
+    def __init__(self, incoming_graph_data=None, **attr):
+        self._node_lines = {}
+        self._edge_lines = {}
+        self._stale = False
+        self._quiet = False
+        super().__init__(incoming_graph_data, **attr)
+
+    def node_attr_dict_factory(self):
+        return _AttrDict(self._attrs_changed)
+
+    edge_attr_dict_factory = node_attr_dict_factory
+
+    def _attrs_changed(self):
+        # Our own add methods refresh the lines they touch, so only outside edits mark the text stale
+        if not getattr(self, "_quiet", False):
+            self._stale = True
+
+    def _quietly(self, method, *args, **attr):
+        self._quiet = True
+        try:
+            method(*args, **attr)
+        finally:
+            self._quiet = False
+
+    def _node_line(self, n):
+        data = self._node[n]
+        return f"Node: {n}, Label: {data.get('label', n)}, Type: {data.get('type', 'concept')}\n"
+
+    def _edge_line(self, u, v):
+        relation = self._adj[u][v].get('relation', 'RELATES-TO')
+        return f"Edge: {self._node[u].get('label', u)} --[{relation}]--> {self._node[v].get('label', v)}\n"
+
+    def _refresh_node(self, n):
+        self._node_lines[n] = self._node_line(n)
+        # Edge lines show node labels, so refresh the ones touching this node
+        for u, v in (*self.in_edges(n), *self.out_edges(n)):
+            self._edge_lines[u, v] = self._edge_line(u, v)
+
+    def _refresh_edge(self, u, v):
+        for n in (u, v):
+            if n not in self._node_lines:
+                self._node_lines[n] = self._node_line(n)
+        self._edge_lines[u, v] = self._edge_line(u, v)
+
+    def add_node(self, node_for_adding, **attr):
+        self._quietly(super().add_node, node_for_adding, **attr)
+        self._refresh_node(node_for_adding)
+
+    def add_nodes_from(self, nodes_for_adding, **attr):
+        nodes_for_adding = list(nodes_for_adding)
+        self._quietly(super().add_nodes_from, nodes_for_adding, **attr)
+        for n in nodes_for_adding:
+            # Same rule as NetworkX: anything hashable that is now a node, tuples included, is the
+            # node itself; otherwise it was a (node, attrs) pair
+            try:
+                node = n if n in self._node else n[0]
+            except TypeError:
+                node = n[0]
+            self._refresh_node(node)
+
+    def add_edge(self, u_of_edge, v_of_edge, **attr):
+        self._quietly(super().add_edge, u_of_edge, v_of_edge, **attr)
+        self._refresh_edge(u_of_edge, v_of_edge)
+
+    def add_edges_from(self, ebunch_to_add, **attr):
+        ebunch_to_add = list(ebunch_to_add)
+        self._quietly(super().add_edges_from, ebunch_to_add, **attr)
+        for e in ebunch_to_add:
+            self._refresh_edge(e[0], e[1])
+
+    def remove_node(self, n):
+        edges = (*self.in_edges(n), *self.out_edges(n))
+        super().remove_node(n)
+        self._node_lines.pop(n, None)
+        for e in edges:
+            self._edge_lines.pop(e, None)
+
+    def remove_nodes_from(self, nodes):
+        nodes = [n for n in nodes if n in self._node]
+        edges = [e for n in nodes for e in (*self.in_edges(n), *self.out_edges(n))]
+        super().remove_nodes_from(nodes)
+        for n in nodes:
+            self._node_lines.pop(n, None)
+        for e in edges:
+            self._edge_lines.pop(e, None)
+
+    def remove_edge(self, u, v):
+        super().remove_edge(u, v)
+        self._edge_lines.pop((u, v), None)
+
+    def remove_edges_from(self, ebunch):
+        ebunch = list(ebunch)
+        super().remove_edges_from(ebunch)
+        for e in ebunch:
+            self._edge_lines.pop((e[0], e[1]), None)
+
+    def clear(self):
+        super().clear()
+        self._node_lines.clear()
+        self._edge_lines.clear()
+        self._stale = False
+
+    def clear_edges(self):
+        super().clear_edges()
+        self._edge_lines.clear()
+
+    def to_string(self):
+        if self._stale:
+            self._node_lines = {n: self._node_line(n) for n in self._node}
+            self._edge_lines = {(u, v): self._edge_line(u, v) for u, v in self.edges()}
+            self._stale = False
+        return f"Nodes:\n{''.join(self._node_lines.values())}\nEdges:\n{''.join(self._edge_lines.values())}"
+
 # Initialize a simple knowledge graph
 def initialize_knowledge_graph():
-    G = nx.DiGraph()
+    G = CachedGraph()
     
     # Add some initial nodes
     nodes = [
@@ -31,8 +201,7 @@ def initialize_knowledge_graph():
     ]
     
     # Add nodes to graph
-    for node in nodes:
-        G.add_node(node["id"], label=node["label"], type=node["type"])
+    G.add_nodes_from((node["id"], {"label": node["label"], "type": node["type"]}) for node in nodes)
     
     # Add some initial relationships
     edges = [
@@ -41,8 +210,7 @@ def initialize_knowledge_graph():
     ]
     
     # Add edges to graph
-    for edge in edges:
-        G.add_edge(edge["source"], edge["target"], relation=edge["relation"])
+    G.add_edges_from((edge["source"], edge["target"], {"relation": edge["relation"]}) for edge in edges)
     
     return G
 
@@ -50,8 +218,15 @@ def initialize_knowledge_graph():
 def visualize_graph(G, title="Knowledge Graph"):
     plt.figure(figsize=(10, 8))
     
-    # Create position layout
-    pos = nx.spring_layout(G, seed=42)
+    # Create position layout, keeping nodes from this graph's last drawing where they were,
+    # so only new nodes have to be placed
+    last_layout = G.graph.get("layout", {})
+    known = [node for node in G if node in last_layout]
+    if known:
+        pos = nx.spring_layout(G, pos={node: last_layout[node] for node in known}, fixed=known, seed=42)
+    else:
+        pos = nx.spring_layout(G, seed=42)
+    G.graph["layout"] = pos
     
     # Draw nodes
     nx.draw_networkx_nodes(G, pos, node_color='lightblue', node_size=500)
@@ -76,50 +251,90 @@ def visualize_graph(G, title="Knowledge Graph"):
 
 # Convert NetworkX graph to a string representation for the LLM
 def graph_to_string(G):
-    nodes_str = ""
-    for node_id in G.nodes():
-        label = G.nodes[node_id].get('label', node_id)
-        node_type = G.nodes[node_id].get('type', 'concept')
-        nodes_str += f"Node: {node_id}, Label: {label}, Type: {node_type}\n"
-    
-    edges_str = ""
-    for source, target, data in G.edges(data=True):
-        source_label = G.nodes[source].get('label', source)
-        target_label = G.nodes[target].get('label', target)
-        relation = data.get('relation', 'RELATES-TO')
-        edges_str += f"Edge: {source_label} --[{relation}]--> {target_label}\n"
+    # Views such as G.subgraph(...) don't keep the text up to date, so only the graph itself can use it
+    if isinstance(G, CachedGraph) and not nx.is_frozen(G):
+        return G.to_string()
+    
+    nodes_str = "".join(
+        f"Node: {node_id}, Label: {data.get('label', node_id)}, Type: {data.get('type', 'concept')}\n"
+        for node_id, data in G.nodes(data=True)
+    )
+    edges_str = "".join(
+        f"Edge: {G.nodes[source].get('label', source)} --[{data.get('relation', 'RELATES-TO')}]--> "
+        f"{G.nodes[target].get('label', target)}\n"
+        for source, target, data in G.edges(data=True)
+    )
     
     return f"Nodes:\n{nodes_str}\nEdges:\n{edges_str}"
 
-# Test the add_node function using GPT-4o
-def test_add_node(G, node_type, topic):
+# Instructions and response format for test_add_node. They never change, so they open every
+# prompt and the per-call graph and topic go last, letting repeated calls share the prefix
+ADD_NODE_INSTRUCTIONS = """
+You are an AI assistant that helps expand knowledge graphs by suggesting new concepts.
+
+You will be given the current state of a knowledge graph, a node type, a topic and a number of nodes.
+Your task is to suggest that many new nodes of that type related to the topic that would be valuable
+to add to the knowledge graph.
+
+For each node give:
+- node_id: a unique ID for the new node, continuing the existing numbering (e.g., n4, n5, etc.)
+- label: a descriptive label for the new node
+- type: the requested node type
+- description: a brief description explaining what this concept is
+- connections: the existing or newly suggested nodes it connects to, each with
+  - target_node: the ID of the node to connect to
+  - relation: the type of relationship (e.g., IS-A, RELATES-TO, INFLUENCES, etc.)
+  - explanation: a brief explanation of why this relationship exists
+"""
+
+# Structured Outputs schema, so the response always parses into this shape
+ADD_NODE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "nodes": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "node_id": {"type": "string"},
+                    "label": {"type": "string"},
+                    "type": {"type": "string"},
+                    "description": {"type": "string"},
+                    "connections": {
+                        "type": "array",
+                        "items": {
+                            "type": "object",
+                            "properties": {
+                                "target_node": {"type": "string"},
+                                "relation": {"type": "string"},
+                                "explanation": {"type": "string"}
+                            },
+                            "required": ["target_node", "relation", "explanation"],
+                            "additionalProperties": False
+                        }
+                    }
+                },
+                "required": ["node_id", "label", "type", "description", "connections"],
+                "additionalProperties": False
+            }
+        }
+    },
+    "required": ["nodes"],
+    "additionalProperties": False
+}
+
+# Test the add_node function using GPT-4o, asking for num_nodes new nodes in a single call
+def test_add_node(G, node_type, topic, num_nodes=1):
     # Create a prompt for GPT-4o
     graph_representation = graph_to_string(G)
     
-    prompt = f"""
-You are an AI assistant that helps expand knowledge graphs by suggesting new concepts.
-
-Here is the current state of a knowledge graph:
+    prompt = f"""{ADD_NODE_INSTRUCTIONS}
+Here is the current state of the knowledge graph:
 {graph_representation}
 
-Your task is to suggest a new node of type "{node_type}" related to the topic "{topic}" that would be valuable to add to this knowledge graph.
-
-Return your response in the following JSON format only:
-{{
-    "node_id": "unique ID for the new node (e.g., n4, n5, etc.)",
-    "label": "descriptive label for the new node",
-    "type": "{node_type}",
-    "description": "brief description explaining what this concept is",
-    "connections": [
-        {{
-            "target_node": "ID of an existing node to connect to",
-            "relation": "type of relationship (e.g., IS-A, RELATES-TO, INFLUENCES, etc.)",
-            "explanation": "brief explanation of why this relationship exists"
-        }}
-    ]
-}}
-
-Make sure your output is valid JSON that can be directly parsed.
+Node type: "{node_type}"
+Topic: "{topic}"
+Number of nodes: {num_nodes}
 """
 
     try:
@@ -128,35 +343,35 @@ Make sure your output is valid JSON that can be directly parsed.
             model="gpt-4o",
             messages=[{"role": "user", "content": prompt}],
             temperature=0.7,
-            max_tokens=500,
-            response_format={"type": "json_object"}
+            max_tokens=500 * num_nodes,
+            response_format={
+                "type": "json_schema",
+                "json_schema": {"name": "new_nodes", "schema": ADD_NODE_SCHEMA, "strict": True}
+            }
         )
         
         # Extract and parse the response
-        result = json.loads(response.choices[0].message.content)
+        result = json_loads(response.choices[0].message.content)
+        nodes = result["nodes"]
         
         # Print the suggestion
         print("\nGPT-4o Suggestion:")
         print(json.dumps(result, indent=2))
         
-        # Add the new node to the graph
-        G.add_node(
-            result["node_id"], 
-            label=result["label"], 
-            type=result["type"],
-            description=result["description"]
+        # Add the new nodes and their connections to the graph in bulk
+        G.add_nodes_from(
+            (node["node_id"], {"label": node["label"], "type": node["type"], "description": node["description"]})
+            for node in nodes
+        )
+        G.add_edges_from(
+            (node["node_id"], connection["target_node"],
+             {"relation": connection["relation"], "explanation": connection["explanation"]})
+            for node in nodes
+            for connection in node["connections"]
         )
         
-        # Add the connections
-        for connection in result["connections"]:
-            G.add_edge(
-                result["node_id"],
-                connection["target_node"],
-                relation=connection["relation"],
-                explanation=connection["explanation"]
-            )
-        
-        print(f"\nSuccessfully added new node '{result['label']}' to the knowledge graph with {len(result['connections'])} connections")
+        for node in nodes:
+            print(f"\nSuccessfully added new node '{node['label']}' to the knowledge graph with {len(node['connections'])} connections")
         return G, result
     
     except Exception as e:
@@ -176,8 +391,8 @@ def main():
     topic = "sustainable construction materials"
     node_type = "concept"
     
-    # Call the function
-    G, result = test_add_node(G, node_type, topic)
+    # Call the function, asking for a few nodes in one request
+    G, result = test_add_node(G, node_type, topic, num_nodes=3)
     
     if result:
         # Visualize the updated graph
@@ -190,10 +405,11 @@ def main():
         
         # Print new relationships
         print("\nNew relationships:")
-        for connection in result["connections"]:
-            source_label = G.nodes[result["node_id"]]["label"]
-            target_label = G.nodes[connection["target_node"]]["label"]
-            print(f"- {source_label} --[{connection['relation']}]--> {target_label}: {connection['explanation']}")
+        for node in result["nodes"]:
+            source_label = G.nodes[node["node_id"]]["label"]
+            for connection in node["connections"]:
+                target_label = G.nodes[connection["target_node"]].get("label", connection["target_node"])
+                print(f"- {source_label} --[{connection['relation']}]--> {target_label}: {connection['explanation']}")
 
 if __name__ == "__main__":
     main()